@@ -1,8 +1,14 @@
 from flask import Flask, request, render_template, redirect, url_for, session, flash
+from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
 import sqlite3
+import queue
+import threading
 import logging
+from contextlib import contextmanager
+from itertools import chain
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
 
 # Setting up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,27 +16,92 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+app.jinja_env.auto_reload = False
 
 # Database setup
+INSERT_PRODUCT_SQL = "INSERT INTO products (name, price, category) VALUES (?, ?, ?)"
+INSERT_OR_IGNORE_PRODUCT_SQL = "INSERT OR IGNORE INTO products (name, price, category) VALUES (?, ?, ?)"
+SELECT_PRODUCTS_SQL = "SELECT name, price, category FROM products"
+SELECT_PRODUCT_BY_NAME_SQL = "SELECT name, price, category FROM products WHERE name = ?"
+INSERT_USER_SQL = "INSERT INTO users (username, password) VALUES (?, ?)"
+SELECT_USER_AUTH_SQL = "SELECT id, password FROM users WHERE username = ?"
+UPDATE_PASSWORD_SQL = "UPDATE users SET password = ? WHERE id = ?"
+INSERT_ORDER_SQL = "INSERT INTO orders (user_id, total_amount, payment_method, summary) VALUES (?, ?, ?, ?)"
+SELECT_ORDERS_BY_USER_SQL = "SELECT order_id, total_amount, payment_method, summary FROM orders WHERE user_id = ?"
+
 class Database:
-    def __init__(self, db_name: str):
-        self.connection = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.connection.cursor()
+    def __init__(self, db_name: str, pool_size: int = 5):
+        self.db_name = db_name
+        # Small pool of connections checked out per call: readers don't queue
+        # behind one shared connection (WAL lets them run alongside a writer)
+        # and each connection keeps its statement cache across requests.
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # The connection the current thread has checked out, so nested
+        # calls (e.g. inside a transaction) reuse it
+        self._local = threading.local()
+        conn = self._connect()
+        # journal_mode is stored in the database file, so set it once
+        conn.execute("PRAGMA journal_mode=WAL")
+        self._pool.put(conn)
         self.create_tables()
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, isolation_level=None, check_same_thread=False,
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        return conn
+
+    @contextmanager
+    def _conn(self) -> Iterator[sqlite3.Connection]:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # Take the write lock up front so everything inside commits together
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
     def create_tables(self):
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS products (
+        with self.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS products (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 name TEXT NOT NULL,
                                 price REAL NOT NULL,
                                 category TEXT NOT NULL
                               )''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+            conn.execute('''CREATE TABLE IF NOT EXISTS users (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 username TEXT NOT NULL UNIQUE,
                                 password TEXT NOT NULL
                               )''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
+            conn.execute('''CREATE TABLE IF NOT EXISTS orders (
                                 order_id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 user_id INTEGER,
                                 total_amount REAL,
@@ -38,47 +109,47 @@ class Database:
                                 summary TEXT,
                                 FOREIGN KEY(user_id) REFERENCES users(id)
                               )''')
-        self.connection.commit()
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name ON products(name)")
 
     def insert_product(self, name: str, price: float, category: str):
-        self.cursor.execute("INSERT INTO products (name, price, category) VALUES (?, ?, ?)",
-                            (name, price, category))
-        self.connection.commit()
-
-    def fetch_products(self) -> List[Dict]:
-        self.cursor.execute("SELECT name, price, category FROM products")
-        rows = self.cursor.fetchall()
-        products = [{"name": row[0], "price": row[1], "category": row[2]} for row in rows]
-        return products
-
-    def fetch_product_by_name(self, name: str) -> Optional[Dict]:
-        self.cursor.execute("SELECT name, price, category FROM products WHERE name = ?", (name,))
-        row = self.cursor.fetchone()
-        if row:
-            return {"name": row[0], "price": row[1], "category": row[2]}
-        return None
+        with self._conn() as conn:
+            conn.execute(INSERT_PRODUCT_SQL, (name, price, category))
 
-    def insert_user(self, username: str, password: str):
-        self.cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        self.connection.commit()
+    def bulk_insert_products(self, rows: Iterable[tuple], ignore_existing: bool = False):
+        # One transaction for the whole batch instead of a commit per row.
+        # With ignore_existing, rows whose name is already present are skipped.
+        sql = INSERT_OR_IGNORE_PRODUCT_SQL if ignore_existing else INSERT_PRODUCT_SQL
+        with self.transaction() as conn:
+            conn.executemany(sql, rows)
 
-    def fetch_user(self, username: str) -> Optional[Dict]:
-        self.cursor.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
-        row = self.cursor.fetchone()
-        if row:
-            return {"id": row[0], "username": row[1], "password": row[2]}
-        return None
+    def fetch_products(self) -> List[sqlite3.Row]:
+        with self._conn() as conn:
+            return conn.execute(SELECT_PRODUCTS_SQL).fetchall()
+
+    def fetch_product_by_name(self, name: str) -> Optional[sqlite3.Row]:
+        with self._conn() as conn:
+            return conn.execute(SELECT_PRODUCT_BY_NAME_SQL, (name,)).fetchone()
+
+    def insert_user(self, username: str, password: str) -> int:
+        with self._conn() as conn:
+            return conn.execute(INSERT_USER_SQL, (username, password)).lastrowid
+
+    def fetch_user_auth(self, username: str) -> Optional[sqlite3.Row]:
+        with self._conn() as conn:
+            return conn.execute(SELECT_USER_AUTH_SQL, (username,)).fetchone()
+
+    def update_password(self, user_id: int, password: str):
+        with self._conn() as conn:
+            conn.execute(UPDATE_PASSWORD_SQL, (password, user_id))
 
     def insert_order(self, user_id: int, total_amount: float, payment_method: str, summary: str):
-        self.cursor.execute("INSERT INTO orders (user_id, total_amount, payment_method, summary) VALUES (?, ?, ?, ?)",
-                            (user_id, total_amount, payment_method, summary))
-        self.connection.commit()
+        with self._conn() as conn:
+            conn.execute(INSERT_ORDER_SQL, (user_id, total_amount, payment_method, summary))
 
-    def fetch_orders_by_user_id(self, user_id: int) -> List[Dict]:
-        self.cursor.execute("SELECT order_id, total_amount, payment_method, summary FROM orders WHERE user_id = ?", (user_id,))
-        rows = self.cursor.fetchall()
-        orders = [{"order_id": row[0], "total_amount": row[1], "payment_method": row[2], "summary": row[3]} for row in rows]
-        return orders
+    def fetch_orders_by_user_id(self, user_id: int) -> List[sqlite3.Row]:
+        with self._conn() as conn:
+            return conn.execute(SELECT_ORDERS_BY_USER_SQL, (user_id,)).fetchall()
 
 # User Authentication
 class User:
@@ -86,28 +157,44 @@ class User:
         self.user_id = user_id
         self.username = username
         self.password = password
-        self.cart = Cart.get_instance()
+        self.cart = get_cart(user_id)
+
+def _is_password_hash(value: str) -> bool:
+    # werkzeug hashes look like "method$salt$hash", e.g. "scrypt:32768:8:1$...$..."
+    method, _, rest = value.partition("$")
+    return method.split(":", 1)[0] in ("scrypt", "pbkdf2") and rest.count("$") == 1
 
 class AuthService:
     def __init__(self, db: Database):
         self.db = db
 
     def register_user(self, username: str, password: str) -> User:
-        if self.db.fetch_user(username):
+        if self.db.fetch_user_auth(username):
             raise ValueError("User already exists.")
-        self.db.insert_user(username, password)
-        user_data = self.db.fetch_user(username)
-        user = User(user_data["id"], username, password)
+        password_hash = generate_password_hash(password)
+        user_id = self.db.insert_user(username, password_hash)
+        user = User(user_id, username, password_hash)
         logger.info(f"User {username} registered.")
         return user
 
     def login(self, username: str, password: str) -> User:
-        user_data = self.db.fetch_user(username)
-        if user_data and user_data['password'] == password:
-            logger.info(f"User {username} logged in.")
-            return User(user_data["id"], username, password)
-        else:
+        user_data = self.db.fetch_user_auth(username)
+        if not user_data:
             raise ValueError("Invalid username or password.")
+        stored = user_data['password']
+        if _is_password_hash(stored):
+            if not check_password_hash(stored, password):
+                raise ValueError("Invalid username or password.")
+        else:
+            # Accounts created before passwords were hashed: check the
+            # plaintext once and replace it with a hash
+            if not hmac.compare_digest(stored.encode(), password.encode()):
+                raise ValueError("Invalid username or password.")
+            stored = generate_password_hash(password)
+            self.db.update_password(user_data["id"], stored)
+            logger.info(f"Upgraded password storage for user {username}.")
+        logger.info(f"User {username} logged in.")
+        return User(user_data["id"], username, stored)
 
 # Product Catalog
 class Product:
@@ -128,75 +215,110 @@ class ConcreteProductFactory(ProductFactory):
 class Catalog:
     def __init__(self, db: Database):
         self.db = db
+        # The catalog is read-heavy and only changes through add_product,
+        # so keep the product list in memory and drop it on writes.
+        self._products_cache: Optional[List[Product]] = None
+        self._by_name: Dict[str, Product] = {}
+        self._lock = threading.Lock()
 
     def add_product(self, product: Product):
         self.db.insert_product(product.name, product.price, product.category)
+        with self._lock:
+            self._products_cache = None
+            self._by_name = {}
         logger.info(f"Product {product.name} added to catalog.")
 
     def get_product(self, name: str) -> Optional[Product]:
+        self.list_products()
+        product = self._by_name.get(name)
+        if product:
+            return product
         product_data = self.db.fetch_product_by_name(name)
         if product_data:
             return Product(product_data["name"], product_data["price"], product_data["category"])
         return None
 
     def list_products(self) -> List[Product]:
-        products_data = self.db.fetch_products()
-        return [Product(p["name"], p["price"], p["category"]) for p in products_data]
+        products = self._products_cache
+        if products is not None:
+            return products
+        with self._lock:
+            if self._products_cache is None:
+                products_data = self.db.fetch_products()
+                products = [Product(p["name"], p["price"], p["category"]) for p in products_data]
+                self._by_name = {p.name: p for p in products}
+                self._products_cache = products
+            return self._products_cache
+
+# Per-user Cart
+class CartLine:
+    __slots__ = ('product', 'quantity')
+
+    def __init__(self, product: Product, quantity: int):
+        self.product = product
+        self.quantity = quantity
 
-# Singleton Cart
 class Cart:
-    _instance = None
-
     def __init__(self):
-        if not Cart._instance:
-            self.items = {}
-            Cart._instance = self
-        else:
-            raise Exception("This class is a singleton!")
-
-    @staticmethod
-    def get_instance():
-        if not Cart._instance:
-            Cart()
-        return Cart._instance
+        self.items: Dict[str, CartLine] = {}
+        self._total: float = 0.0
 
     def add_item(self, product: Product, quantity: int):
-        if product.name in self.items:
-            self.items[product.name]['quantity'] += quantity
+        line = self.items.get(product.name)
+        if line:
+            line.quantity += quantity
         else:
-            self.items[product.name] = {'product': product, 'quantity': quantity}
+            self.items[product.name] = CartLine(product, quantity)
+        self._total += product.price * quantity
         logger.info(f"Added {quantity} of {product.name} to cart.")
 
     def remove_item(self, product: Product):
         if product.name in self.items:
-            del self.items[product.name]
+            line = self.items.pop(product.name)
+            self._total -= line.product.price * line.quantity
             logger.info(f"Removed {product.name} from cart.")
 
-    def get_items(self) -> Dict[str, Dict[str, any]]:
+    def get_items(self) -> Dict[str, CartLine]:
         return self.items
 
+    def total(self) -> float:
+        return self._total
+
     def clear(self):
         self.items = {}
+        self._total = 0.0
+
+# Carts live for the lifetime of the process, one per user id
+_CART_REGISTRY: Dict[int, Cart] = {}
+_cart_registry_lock = threading.Lock()
+
+def get_cart(user_id: int) -> Cart:
+    cart = _CART_REGISTRY.get(user_id)
+    if cart is None:
+        with _cart_registry_lock:
+            cart = _CART_REGISTRY.setdefault(user_id, Cart())
+    return cart
 
 # Order Processing
 class Order:
-    def __init__(self, user: User):
-        self.user = user
-        self.items = user.cart.get_items()
+    def __init__(self, user_id: int, cart: Cart):
+        self.user_id = user_id
+        self.cart = cart
+        self.items = cart.get_items()
 
 class OrderProcessor:
     @staticmethod
-    def create_order(user: User) -> Order:
-        if not user.cart.get_items():
+    def create_order(user_id: int, cart: Cart) -> Order:
+        if not cart.get_items():
             raise ValueError("Cart is empty.")
-        order = Order(user)
-        logger.info(f"Order created for user {user.username}.")
+        order = Order(user_id, cart)
+        logger.info(f"Order created for user {user_id}.")
         return order
 
     @staticmethod
-    def confirm_order(user: User):
-        user.cart.clear()
-        logger.info(f"Order confirmed for user {user.username}.")
+    def confirm_order(order: Order):
+        order.cart.clear()
+        logger.info(f"Order confirmed for user {order.user_id}.")
 
 # Payment Processing
 class PaymentGateway(ABC):
@@ -214,43 +336,46 @@ class PaymentProcessor:
         self.payment_gateway = payment_gateway
 
     def process_order_payment(self, order: Order, payment_method: str) -> bool:
-        total_amount = sum(item['product'].price * item['quantity'] for item in order.items.values())
+        total_amount = order.cart.total()
         return self.payment_gateway.process_payment(total_amount), total_amount
 
 # Initialize components
 db = Database('shopping.db')
 auth_service = AuthService(db)
 catalog = Catalog(db)
-product_factory = ConcreteProductFactory()
-
-# Add some products to the catalog if empty
-if not db.fetch_products():  # Only add products if the database is empty
-    categories = {
-        "Electronics": [
-            ("Laptop", 1200.0),
-            ("Smartphone", 800.0),
-            ("Tablet", 500.0)
-        ],
-        "Home Appliances": [
-            ("Refrigerator", 1500.0),
-            ("Microwave", 200.0),
-            ("Washing Machine", 1000.0)
-        ],
-        "Books": [
-            ("The Hobbit", 40.0),
-            ("Train to Pakistan", 35.0),
-            ("Harry Potter and the Deathly Hallows", 55.0)
-        ],
-        "Clothing": [
-            ("Shirt", 30.0),
-            ("Jeans", 50.0),
-            ("Jacket", 100.0)
-        ]
-    }
-    for category, products in categories.items():
-        for name, price in products:
-            product = product_factory.create_product(name, price, category)
-            catalog.add_product(product)
+payment_processor = PaymentProcessor(MockPaymentGateway())
+
+# Seed the catalog; products that already exist are left untouched
+SEED_CATEGORIES = {
+    "Electronics": [
+        ("Laptop", 1200.0),
+        ("Smartphone", 800.0),
+        ("Tablet", 500.0)
+    ],
+    "Home Appliances": [
+        ("Refrigerator", 1500.0),
+        ("Microwave", 200.0),
+        ("Washing Machine", 1000.0)
+    ],
+    "Books": [
+        ("The Hobbit", 40.0),
+        ("Train to Pakistan", 35.0),
+        ("Harry Potter and the Deathly Hallows", 55.0)
+    ],
+    "Clothing": [
+        ("Shirt", 30.0),
+        ("Jeans", 50.0),
+        ("Jacket", 100.0)
+    ]
+}
+db.bulk_insert_products(((name, price, category)
+                         for category, products in SEED_CATEGORIES.items()
+                         for name, price in products),
+                        ignore_existing=True)
+
+# Compile every template up front so requests only render from the cache
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
 
 @app.route('/')
 def home():
@@ -307,10 +432,7 @@ def add_to_cart():
     quantity = int(request.form['quantity'])
     product = catalog.get_product(product_name)
     if product:
-        user_id = session['user_id']
-        user = auth_service.db.fetch_user(session['username'])
-        user_obj = User(user['id'], user['username'], user['password'])
-        user_obj.cart.add_item(product, quantity)
+        get_cart(session['user_id']).add_item(product, quantity)
         flash(f"Added {quantity} of {product_name} to cart.", 'success')
     else:
         flash("Product not found.", 'danger')
@@ -322,9 +444,7 @@ def view_cart():
         flash('Please log in first.', 'danger')
         return redirect(url_for('login'))
 
-    user = auth_service.db.fetch_user(session['username'])
-    user_obj = User(user['id'], user['username'], user['password'])
-    cart_items = user_obj.cart.get_items()
+    cart_items = get_cart(session['user_id']).get_items()
     return render_template('cart.html', cart_items=cart_items)
 
 @app.route('/checkout', methods=['GET', 'POST'])
@@ -333,22 +453,19 @@ def checkout():
         flash('Please log in first.', 'danger')
         return redirect(url_for('login'))
 
-    user = auth_service.db.fetch_user(session['username'])
-    user_obj = User(user['id'], user['username'], user['password'])
-
     if request.method == 'POST':
-        order = OrderProcessor.create_order(user_obj)
+        user_id = session['user_id']
+        order = OrderProcessor.create_order(user_id, get_cart(user_id))
         payment_method = request.form['payment_method']
-        payment_gateway = MockPaymentGateway()
-        payment_processor = PaymentProcessor(payment_gateway)
         payment_successful, total_amount = payment_processor.process_order_payment(order, payment_method)
 
         if payment_successful:
-            OrderProcessor.confirm_order(user_obj)
-            summary = "\n".join([f"{item['quantity']}x {item['product'].name} at ${item['product'].price} each"
-                                 for item in order.items.values()])
-            summary += f"\nTotal Amount: ${total_amount:.2f}"
-            db.insert_order(user_obj.user_id, total_amount, payment_method, summary)
+            lines = (f"{line.quantity}x {line.product.name} at ${line.product.price:.2f} each"
+                     for line in order.items.values())
+            summary = "\n".join(chain(lines, (f"Total Amount: ${total_amount:.2f}",)))
+            with db.transaction():
+                db.insert_order(user_id, total_amount, payment_method, summary)
+            OrderProcessor.confirm_order(order)
             flash('Payment processed and order confirmed successfully.', 'success')
             return redirect(url_for('order_history'))
         else:
@@ -362,9 +479,8 @@ def order_history():
         flash('Please log in first.', 'danger')
         return redirect(url_for('login'))
 
-    user = auth_service.db.fetch_user(session['username'])
-    orders = db.fetch_orders_by_user_id(user['id'])
+    orders = db.fetch_orders_by_user_id(session['user_id'])
     return render_template('orders.html', orders=orders)
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=False)